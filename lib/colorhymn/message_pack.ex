@@ -0,0 +1,52 @@
+defmodule Colorhymn.MessagePack do
+  @moduledoc """
+  Minimal MessagePack encoder for the viewer wire format.
+
+  Covers the terms `mix colorize --msgpack` emits: maps, lists, binaries
+  (encoded as str), atoms (as str), integers, floats, booleans and nil.
+  Returns iodata so records can be written without flattening.
+  """
+
+  @doc "Encode a term as MessagePack iodata"
+  def encode(nil), do: <<0xC0>>
+  def encode(false), do: <<0xC2>>
+  def encode(true), do: <<0xC3>>
+  def encode(atom) when is_atom(atom), do: encode(Atom.to_string(atom))
+
+  # Integers: positive/negative fixint, then 64-bit
+  def encode(int) when is_integer(int) and int in 0..127, do: <<int>>
+  def encode(int) when is_integer(int) and int in -32..-1, do: <<int::signed-8>>
+  def encode(int) when is_integer(int) and int >= 0, do: <<0xCF, int::64>>
+  def encode(int) when is_integer(int), do: <<0xD3, int::signed-64>>
+
+  def encode(float) when is_float(float), do: <<0xCB, float::float-64>>
+
+  def encode(bin) when is_binary(bin) do
+    [str_header(byte_size(bin)), bin]
+  end
+
+  def encode(list) when is_list(list) do
+    [array_header(length(list)) | Enum.map(list, &encode/1)]
+  end
+
+  def encode(map) when is_map(map) do
+    [map_header(map_size(map)) | Enum.map(map, fn {k, v} -> [encode(k), encode(v)] end)]
+  end
+
+  # ============================================================================
+  # Headers
+  # ============================================================================
+
+  defp str_header(size) when size < 32, do: <<0xA0 + size>>
+  defp str_header(size) when size < 0x100, do: <<0xD9, size>>
+  defp str_header(size) when size < 0x10000, do: <<0xDA, size::16>>
+  defp str_header(size), do: <<0xDB, size::32>>
+
+  defp array_header(size) when size < 16, do: <<0x90 + size>>
+  defp array_header(size) when size < 0x10000, do: <<0xDC, size::16>>
+  defp array_header(size), do: <<0xDD, size::32>>
+
+  defp map_header(size) when size < 16, do: <<0x80 + size>>
+  defp map_header(size) when size < 0x10000, do: <<0xDE, size::16>>
+  defp map_header(size), do: <<0xDF, size::32>>
+end
@@ -1,13 +1,51 @@
 defmodule Mix.Tasks.Colorize do
-  @moduledoc "Colorize a log file and output JSON"
+  @moduledoc """
+  Colorize a log file and output JSON Lines.
+
+  Output starts with a `"\\x1eJSON"` marker line so frontends can skip
+  any compiler output Mix printed before the task ran. The next line is a
+  header object with the file metadata, palette and `colors`, the table of
+  distinct palette colors tokens are drawn in. Each following line holds
+  the tokens of one source line as parallel arrays,
+  `{"v": [value, ...], "c": [index, ...]}`, where each index points into
+  `colors`. Frontends can render each line as soon as it is read.
+
+  `mix colorize --msgpack <file>` writes the same records as a stream of
+  MessagePack maps after a `"\\x1eMSGPACK"` marker line. It is smaller
+  and faster to decode for frontends that have a MessagePack library.
+
+  `mix colorize --serve <socket>` keeps the task running as a server on a
+  Unix domain socket, so frontends skip Mix and BEAM startup on every
+  file. Each connection sends `"<version> jsonl <path>"` or
+  `"<version> msgpack <path>"` followed by a newline and receives the same
+  output as the matching command, or a plain-text error line without the
+  marker. The version is the project version and the newest `lib/**/*.ex`
+  mtime in seconds, joined by `-`; on a mismatch the server answers
+  `"\\x1eSTALE"` and shuts down. It also exits after ten idle minutes, and
+  holds `<socket>.lock` while running so only one server owns the path.
+  """
   use Mix.Task
 
-  alias Colorhymn.{FirstSight, Expression}
+  alias Colorhymn.{FirstSight, Expression, MessagePack}
+  alias Colorhymn.Expression.Color
+
+  @markers %{jsonl: "\x1eJSON\n", msgpack: "\x1eMSGPACK\n"}
+  @stale "\x1eSTALE\n"
+  @idle_timeout :timer.minutes(10)
 
   @shortdoc "Colorize a log file"
+  def run(["--serve", socket_path]), do: serve(socket_path)
+
+  def run(["--msgpack", file_path]) do
+    {:ok, content} = File.read(file_path)
+    # Raw bytes on stdout: binwrite on a unicode device would re-encode them
+    :ok = :io.setopts(:standard_io, encoding: :latin1)
+    output(content, Path.basename(file_path), :msgpack, &IO.binwrite/1)
+  end
+
   def run([file_path]) do
     {:ok, content} = File.read(file_path)
-    output_json(content, Path.basename(file_path))
+    output(content, Path.basename(file_path), :jsonl, &IO.write/1)
   end
 
   def run(["--stdin"]) do
@@ -19,39 +57,228 @@ defmodule Mix.Tasks.Colorize do
         IO.puts(:stderr, "Empty input received on stdin")
         System.halt(1)
       content when is_binary(content) ->
-        output_json(content, "stdin")
+        output(content, "stdin", :jsonl, &IO.write/1)
+    end
+  end
+
+  def run(_), do: IO.puts(:stderr, "Usage: mix colorize [--msgpack] <file> | mix colorize --stdin | mix colorize --serve <socket>")
+
+  # ============================================================================
+  # Socket Server
+  # ============================================================================
+
+  defp serve(socket_path) do
+    lock_path = socket_path <> ".lock"
+
+    case acquire_lock(lock_path) do
+      :ok ->
+        File.rm(socket_path)
+        {:ok, listen} = :gen_tcp.listen(0, [:binary, packet: :line, active: false, ifaddr: {:local, socket_path}])
+        active = accept_loop(listen, version_stamp(), MapSet.new())
+
+        # Stop answering before in-flight clients finish, so a fresh
+        # server can take over the path straight away
+        File.rm(socket_path)
+        release_lock(lock_path)
+        await_clients(active)
+
+      :locked ->
+        IO.puts(:stderr, "Already serving on #{socket_path}")
     end
   end
 
-  def run(_), do: IO.puts(:stderr, "Usage: mix colorize <file> | mix colorize --stdin")
+  # The lock file holds the OS pid of the server that owns the socket path.
+  # A lock left behind by a server that died is taken over.
+  defp acquire_lock(lock_path, retry \\ true) do
+    case File.open(lock_path, [:write, :exclusive]) do
+      {:ok, file} ->
+        IO.write(file, System.pid())
+        File.close(file)
+        :ok
 
-  defp output_json(content, filename) do
+      {:error, :eexist} when retry ->
+        if lock_holder_alive?(lock_path) or File.rm(lock_path) != :ok do
+          :locked
+        else
+          acquire_lock(lock_path, false)
+        end
+
+      {:error, _} ->
+        :locked
+    end
+  end
+
+  defp lock_holder_alive?(lock_path) do
+    case File.read(lock_path) do
+      # Written between open and close by a server that is starting up
+      {:ok, ""} ->
+        true
+
+      {:ok, pid} ->
+        {_, status} = System.cmd("kill", ["-0", pid], stderr_to_stdout: true)
+        status == 0
+
+      {:error, _} ->
+        false
+    end
+  end
+
+  defp release_lock(lock_path) do
+    if File.read(lock_path) == {:ok, System.pid()}, do: File.rm(lock_path)
+  end
+
+  # Matches the stamp frontends derive from mix.exs and the lib sources, so
+  # a server running code older than the checkout can be told apart
+  defp version_stamp do
+    newest =
+      Path.wildcard("lib/**/*.ex")
+      |> Enum.map(&File.stat!(&1, time: :posix).mtime)
+      |> Enum.max(fn -> 0 end)
+
+    "#{Mix.Project.config()[:version]}-#{newest}"
+  end
+
+  # Returns the monitors of clients still being served once the server
+  # has been idle for @idle_timeout or a client found it stale
+  defp accept_loop(listen, stamp, active) do
+    case :gen_tcp.accept(listen, @idle_timeout) do
+      {:ok, socket} ->
+        {pid, ref} =
+          spawn_monitor(fn ->
+            receive do
+              :ready -> handle_client(socket, listen, stamp)
+            end
+          end)
+
+        :ok = :gen_tcp.controlling_process(socket, pid)
+        send(pid, :ready)
+        accept_loop(listen, stamp, MapSet.put(active, ref))
+
+      {:error, :timeout} ->
+        active = reap_clients(active)
+        if MapSet.size(active) == 0, do: active, else: accept_loop(listen, stamp, active)
+
+      {:error, _closed} ->
+        active
+    end
+  end
+
+  defp reap_clients(active) do
+    receive do
+      {:DOWN, ref, :process, _, _} -> reap_clients(MapSet.delete(active, ref))
+    after
+      0 -> active
+    end
+  end
+
+  defp await_clients(active) do
+    Enum.each(active, fn ref ->
+      receive do
+        {:DOWN, ^ref, :process, _, _} -> :ok
+      end
+    end)
+  end
+
+  defp handle_client(socket, listen, stamp) do
+    with {:ok, request} <- :gen_tcp.recv(socket, 0),
+         [request_stamp, format_name, file_path] <- String.split(String.trim_trailing(request, "\n"), " ", parts: 3),
+         :ok <- check_stamp(request_stamp, stamp, socket, listen),
+         {:ok, format} <- parse_format(format_name),
+         {:ok, content} <- File.read(file_path) do
+      output(content, Path.basename(file_path), format, &:gen_tcp.send(socket, &1))
+    else
+      :stale ->
+        :ok
+
+      {:error, reason} ->
+        :gen_tcp.send(socket, "Error: #{:file.format_error(reason)}\n")
+
+      _ ->
+        :gen_tcp.send(socket, "Error: expected \"<version> jsonl <path>\" or \"<version> msgpack <path>\"\n")
+    end
+
+    :gen_tcp.close(socket)
+  end
+
+  # A frontend with a newer stamp means the sources changed since this
+  # server compiled them: tell it and stop accepting connections
+  defp check_stamp(stamp, stamp, _socket, _listen), do: :ok
+
+  defp check_stamp(_request_stamp, _stamp, socket, listen) do
+    :gen_tcp.send(socket, @stale)
+    :gen_tcp.close(listen)
+    :stale
+  end
+
+  defp parse_format("jsonl"), do: {:ok, :jsonl}
+  defp parse_format("msgpack"), do: {:ok, :msgpack}
+  defp parse_format(_), do: :error
+
+  # ============================================================================
+  # Record Output
+  # ============================================================================
+
+  defp output(content, filename, format, write) do
     sight = FirstSight.perceive(content, filename)
     palette = Expression.from_perception(sight)
 
-    lines = content
-    |> String.split("\n")
-    |> Enum.map(fn line ->
-      Expression.render_line_data(palette, line)
-      |> Enum.map(fn {type, value, hex} ->
-        # Simple JSON array: [type, value, color]
-        ~s(["#{type}","#{escape_json(value)}","#{hex}"])
-      end)
-      |> then(&"[#{Enum.join(&1, ",")}]")
-    end)
+    lines = String.split(content, "\n")
+
+    metadata = %{
+      filename: filename,
+      temperature: sight.temperature,
+      temperature_score: Float.round(Map.get(sight, :temperature_score, 0.5), 3),
+      mood: palette.mood,
+      warmth: Float.round(palette.warmth, 3),
+      saturation: Float.round(palette.saturation, 3),
+      line_count: length(lines)
+    }
 
     hex_map = Expression.to_hex_map(palette)
+
+    # Each distinct color is sent once in the header; tokens refer to it by
+    # index. Every token color is a palette entry, or foreground for token
+    # types the palette has no entry for, so lines can stream unbuffered.
+    colors = Enum.uniq([Color.to_hex(palette.foreground) | Map.values(hex_map)])
+
+    color_index = colors |> Enum.with_index() |> Map.new()
+
+    write.(@markers[format])
+    write.(encode_header(format, metadata, hex_map, colors))
+
+    Enum.each(lines, fn line ->
+      tokens = Expression.render_line_data(palette, line)
+      write.(encode_line(format, tokens, color_index))
+    end)
+  end
+
+  defp encode_header(:jsonl, metadata, hex_map, colors) do
     palette_json = hex_map
     |> Enum.map(fn {k, v} -> ~s("#{k}":"#{v}") end)
     |> Enum.join(",")
 
-    temp_score = Map.get(sight, :temperature_score, 0.5)
+    colors_json = Enum.map_join(colors, ",", fn hex -> ~s("#{hex}") end)
+
+    ~s({"metadata":{"filename":"#{escape_json(metadata.filename)}","temperature":"#{metadata.temperature}","temperature_score":#{metadata.temperature_score},"mood":"#{metadata.mood}","warmth":#{metadata.warmth},"saturation":#{metadata.saturation},"line_count":#{metadata.line_count}},"palette":{#{palette_json}},"colors":[#{colors_json}]}\n)
+  end
+
+  defp encode_header(:msgpack, metadata, hex_map, colors) do
+    MessagePack.encode(%{metadata: metadata, palette: hex_map, colors: colors})
+  end
+
+  # Parallel value/color-index arrays rather than a triple per token
+  defp encode_line(:jsonl, tokens, color_index) do
+    values = Enum.map_join(tokens, ",", fn {_type, value, _hex} -> ~s("#{escape_json(value)}") end)
+    indices = Enum.map_join(tokens, ",", fn {_type, _value, hex} -> Integer.to_string(color_index[hex]) end)
+
+    ~s({"v":[#{values}],"c":[#{indices}]}\n)
+  end
 
-    IO.puts(~s({
-"metadata":{"filename":"#{escape_json(filename)}","temperature":"#{sight.temperature}","temperature_score":#{Float.round(temp_score, 3)},"mood":"#{palette.mood}","warmth":#{Float.round(palette.warmth, 3)},"saturation":#{Float.round(palette.saturation, 3)},"line_count":#{length(lines)}},
-"palette":{#{palette_json}},
-"lines":[#{Enum.join(lines, ",")}]
-}))
+  defp encode_line(:msgpack, tokens, color_index) do
+    MessagePack.encode(%{
+      v: Enum.map(tokens, fn {_type, value, _hex} -> value end),
+      c: Enum.map(tokens, fn {_type, _value, hex} -> color_index[hex] end)
+    })
   end
 
   defp escape_json(s) do
@@ -0,0 +1,81 @@
+defmodule Colorhymn.MessagePackTest do
+  use ExUnit.Case, async: true
+
+  alias Colorhymn.MessagePack
+
+  defp encode(term), do: term |> MessagePack.encode() |> IO.iodata_to_binary()
+
+  describe "integers" do
+    test "positive fixint up to 127" do
+      assert encode(0) == <<0x00>>
+      assert encode(127) == <<0x7F>>
+    end
+
+    test "uint64 from 128" do
+      assert encode(128) == <<0xCF, 0, 0, 0, 0, 0, 0, 0, 0x80>>
+      assert encode(0xFFFFFFFFFFFFFFFF) == <<0xCF>> <> :binary.copy(<<0xFF>>, 8)
+    end
+
+    test "negative fixint down to -32" do
+      assert encode(-1) == <<0xFF>>
+      assert encode(-32) == <<0xE0>>
+    end
+
+    test "int64 below -32" do
+      assert encode(-33) == <<0xD3, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xDF>>
+    end
+  end
+
+  describe "strings" do
+    test "fixstr up to 31 bytes" do
+      assert encode("") == <<0xA0>>
+      assert encode(String.duplicate("a", 31)) == <<0xBF>> <> String.duplicate("a", 31)
+    end
+
+    test "str8 from 32 bytes" do
+      assert encode(String.duplicate("a", 32)) == <<0xD9, 32>> <> String.duplicate("a", 32)
+      assert encode(String.duplicate("a", 255)) == <<0xD9, 255>> <> String.duplicate("a", 255)
+    end
+
+    test "str16 from 256 bytes" do
+      long = String.duplicate("a", 256)
+      assert encode(long) == <<0xDA, 0x01, 0x00>> <> long
+    end
+
+    test "atoms encode as strings" do
+      assert encode(:mood) == <<0xA4, "mood">>
+    end
+  end
+
+  describe "arrays" do
+    test "fixarray up to 15 elements" do
+      assert encode([]) == <<0x90>>
+      assert encode(List.duplicate(1, 15)) == <<0x9F>> <> :binary.copy(<<1>>, 15)
+    end
+
+    test "array16 from 16 elements" do
+      assert encode(List.duplicate(1, 16)) == <<0xDC, 0x00, 0x10>> <> :binary.copy(<<1>>, 16)
+    end
+  end
+
+  describe "maps" do
+    test "fixmap up to 15 entries" do
+      assert encode(%{}) == <<0x80>>
+      assert <<0x8F, _::binary>> = encode(Map.new(0..14, &{&1, nil}))
+    end
+
+    test "map16 from 16 entries" do
+      assert <<0xDE, 0x00, 0x10, _::binary>> = encode(Map.new(0..15, &{&1, nil}))
+    end
+
+    test "entries are key then value" do
+      assert encode(%{"v" => 1}) == <<0x81, 0xA1, "v", 0x01>>
+    end
+  end
+
+  test "nil and booleans" do
+    assert encode(nil) == <<0xC0>>
+    assert encode(false) == <<0xC2>>
+    assert encode(true) == <<0xC3>>
+  end
+end
@@ -0,0 +1,184 @@
+defmodule Mix.Tasks.ColorizeTest do
+  use ExUnit.Case
+
+  import ExUnit.CaptureIO
+
+  alias Mix.Tasks.Colorize
+
+  @log """
+  2024-01-15 10:23:45 INFO Connected to 192.168.1.10:8080 "api"
+  2024-01-15 10:23:46 ERROR\tpath C:\\temp\\café failed (code=500)
+
+  2024-01-15 10:23:47 WARN retrying in 5s\
+  """
+
+  setup do
+    path = Path.join(System.tmp_dir!(), "colorhymn-#{System.unique_integer([:positive])}.log")
+    File.write!(path, @log)
+    on_exit(fn -> File.rm(path) end)
+    %{path: path}
+  end
+
+  describe "record stream" do
+    test "JSON Lines: marker, header, then one record per source line", %{path: path} do
+      assert {header, records} = decode_jsonl(capture_io(fn -> Colorize.run([path]) end))
+      assert_stream(header, records, path)
+    end
+
+    test "MessagePack carries the same records as JSON Lines", %{path: path} do
+      {header, records} = decode_jsonl(capture_io(fn -> Colorize.run([path]) end))
+
+      assert "\x1eMSGPACK\n" <> body =
+               capture_io([encoding: :latin1], fn -> Colorize.run(["--msgpack", path]) end)
+
+      assert [^header | ^records] = unpack_all(body)
+    end
+  end
+
+  describe "--serve" do
+    setup %{path: path} do
+      socket_name = "colorhymn-#{System.unique_integer([:positive])}.sock"
+      socket_path = Path.join(System.tmp_dir!(), socket_name)
+      on_exit(fn -> Enum.each([socket_path, socket_path <> ".lock"], &File.rm/1) end)
+
+      start_supervised!({Task, fn -> Colorize.run(["--serve", socket_path]) end})
+      wait_until(fn -> File.exists?(socket_path) end)
+
+      %{path: path, socket_path: socket_path}
+    end
+
+    test "answers a request like the matching command", %{path: path, socket_path: sock} do
+      expected = capture_io(fn -> Colorize.run([path]) end)
+      assert request(sock, "#{version_stamp()} jsonl #{path}") == expected
+    end
+
+    test "answers unreadable files with an error line", %{path: path, socket_path: sock} do
+      assert request(sock, "#{version_stamp()} jsonl #{path}.missing") ==
+               "Error: no such file or directory\n"
+    end
+
+    test "answers malformed requests with an error line", %{path: path, socket_path: sock} do
+      assert "Error: expected " <> _ = request(sock, "jsonl #{path}")
+      assert "Error: expected " <> _ = request(sock, "#{version_stamp()} yaml #{path}")
+    end
+
+    test "replies stale and shuts down on a version mismatch", %{path: path, socket_path: sock} do
+      assert request(sock, "0.0.0-0 jsonl #{path}") == "\x1eSTALE\n"
+
+      wait_until(fn -> not File.exists?(sock) and not File.exists?(sock <> ".lock") end)
+      assert {:error, _} = :gen_tcp.connect({:local, sock}, 0, [:binary])
+    end
+
+    test "leaves a running server alone", %{socket_path: sock} do
+      assert capture_io(:stderr, fn -> Colorize.run(["--serve", sock]) end) =~
+               "Already serving on #{sock}"
+    end
+  end
+
+  # ============================================================================
+  # Helpers
+  # ============================================================================
+
+  defp assert_stream(header, records, path) do
+    assert %{"metadata" => metadata, "palette" => palette, "colors" => colors} = header
+    assert metadata["filename"] == Path.basename(path)
+
+    lines = String.split(@log, "\n")
+    assert metadata["line_count"] == length(lines)
+    assert length(records) == length(lines)
+
+    assert colors == Enum.uniq(colors)
+    assert Enum.all?(Map.values(palette), &(&1 in colors))
+
+    for {%{"v" => values, "c" => indices}, line} <- Enum.zip(records, lines) do
+      assert Enum.join(values) == line
+      assert length(indices) == length(values)
+      assert Enum.all?(indices, &(&1 in 0..(length(colors) - 1)))
+    end
+  end
+
+  defp decode_jsonl(output) do
+    assert "\x1eJSON\n" <> body = output
+    [header | records] = body |> String.split("\n", trim: true) |> Enum.map(&JSON.decode!/1)
+    {header, records}
+  end
+
+  # Same inputs as the viewer: mix.exs version and newest source mtime
+  defp version_stamp do
+    newest =
+      Path.wildcard("lib/**/*.ex")
+      |> Enum.map(&File.stat!(&1, time: :posix).mtime)
+      |> Enum.max()
+
+    "#{Mix.Project.config()[:version]}-#{newest}"
+  end
+
+  defp request(socket_path, line) do
+    {:ok, socket} = :gen_tcp.connect({:local, socket_path}, 0, [:binary, active: false])
+    :ok = :gen_tcp.send(socket, line <> "\n")
+    recv_all(socket, [])
+  end
+
+  defp recv_all(socket, acc) do
+    case :gen_tcp.recv(socket, 0, 5_000) do
+      {:ok, data} -> recv_all(socket, [acc, data])
+      {:error, :closed} -> IO.iodata_to_binary(acc)
+    end
+  end
+
+  defp wait_until(fun, attempts \\ 100) do
+    cond do
+      fun.() -> :ok
+      attempts == 0 -> flunk("condition not met in time")
+      true ->
+        Process.sleep(20)
+        wait_until(fun, attempts - 1)
+    end
+  end
+
+  # Just enough MessagePack decoding for what Colorhymn.MessagePack emits
+
+  defp unpack_all(""), do: []
+
+  defp unpack_all(bin) do
+    {term, rest} = unpack(bin)
+    [term | unpack_all(rest)]
+  end
+
+  defp unpack(<<0xC0, rest::binary>>), do: {nil, rest}
+  defp unpack(<<0xC2, rest::binary>>), do: {false, rest}
+  defp unpack(<<0xC3, rest::binary>>), do: {true, rest}
+  defp unpack(<<int, rest::binary>>) when int < 0x80, do: {int, rest}
+  defp unpack(<<int, rest::binary>>) when int >= 0xE0, do: {int - 0x100, rest}
+  defp unpack(<<0xCF, int::64, rest::binary>>), do: {int, rest}
+  defp unpack(<<0xD3, int::signed-64, rest::binary>>), do: {int, rest}
+  defp unpack(<<0xCB, float::float-64, rest::binary>>), do: {float, rest}
+  defp unpack(<<byte, rest::binary>>) when byte in 0xA0..0xBF, do: unpack_str(byte - 0xA0, rest)
+  defp unpack(<<0xD9, size, rest::binary>>), do: unpack_str(size, rest)
+  defp unpack(<<0xDA, size::16, rest::binary>>), do: unpack_str(size, rest)
+  defp unpack(<<0xDB, size::32, rest::binary>>), do: unpack_str(size, rest)
+  defp unpack(<<byte, rest::binary>>) when byte in 0x90..0x9F, do: unpack_list(byte - 0x90, rest)
+  defp unpack(<<0xDC, size::16, rest::binary>>), do: unpack_list(size, rest)
+  defp unpack(<<0xDD, size::32, rest::binary>>), do: unpack_list(size, rest)
+  defp unpack(<<byte, rest::binary>>) when byte in 0x80..0x8F, do: unpack_map(byte - 0x80, rest)
+  defp unpack(<<0xDE, size::16, rest::binary>>), do: unpack_map(size, rest)
+  defp unpack(<<0xDF, size::32, rest::binary>>), do: unpack_map(size, rest)
+
+  defp unpack_str(size, bin) do
+    <<str::binary-size(size), rest::binary>> = bin
+    {str, rest}
+  end
+
+  defp unpack_list(0, rest), do: {[], rest}
+
+  defp unpack_list(size, bin) do
+    {term, rest} = unpack(bin)
+    {terms, rest} = unpack_list(size - 1, rest)
+    {[term | terms], rest}
+  end
+
+  defp unpack_map(size, bin) do
+    {terms, rest} = unpack_list(2 * size, bin)
+    {terms |> Enum.chunk_every(2) |> Map.new(fn [key, value] -> {key, value} end), rest}
+  end
+end
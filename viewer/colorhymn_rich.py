@@ -4,14 +4,37 @@ Colorhymn Rich Viewer - Simple terminal viewer using Rich.
 For quick viewing without Textual. Supports piping and less.
 """
 
-import json
+import hashlib
+import os
+import re
+import shutil
+import socket
+import stat
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+from itertools import accumulate
 from pathlib import Path
 
+try:
+    # Decodes the token-heavy records 2-3x faster, straight from bytes
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+try:
+    # Smaller records that decode faster than JSON, read straight off the pipe
+    import msgpack
+except ImportError:
+    msgpack = None
+
 try:
     from rich.console import Console
-    from rich.text import Text
+    from rich.control import strip_control_codes
+    from rich.style import Style
+    from rich.text import Span, Text
 except ImportError:
     # Fallback: output raw ANSI from Elixir
     print("Rich not installed. Using raw ANSI output.", file=sys.stderr)
@@ -20,27 +43,323 @@ else:
     RICH_AVAILABLE = True
 
 
+# Read buffer for the mix colorize pipe; the default would issue a read
+# syscall per pipe chunk while draining large output
+PIPE_BUFSIZE = 65536
+
+# Seconds mix colorize may take to start answering (compile + perception)
+# before it is killed
+COLORIZE_TIMEOUT = 30
+
+# render_ansi writes its output in chunks of at least this size
+OUTPUT_BUFSIZE = 65536
+
+# Record format requested from mix colorize
+WIRE_FORMAT = "msgpack" if msgpack is not None else "jsonl"
+
+# Line mix colorize writes before its records, per format
+MARKERS = {"jsonl": b"\x1eJSON\n", "msgpack": b"\x1eMSGPACK\n"}
+
+# Colorized output of unchanged files is reused from here
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "colorhymn"
+
+# Entries beyond these limits are pruned, least recently used first
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+# Long-lived `mix colorize --serve` listens here so viewers skip BEAM startup.
+# Only the per-user runtime dir is trusted; without it mix runs every time.
+RUNTIME_DIR = os.environ.get("XDG_RUNTIME_DIR")
+SOCKET_PATH = Path(RUNTIME_DIR) / "colorhymn.sock" if RUNTIME_DIR else None
+
+SGR_RESET = b"\033[0m"
+
+
+def sgr_prefix(color: str) -> bytes:
+    """24-bit foreground SGR escape for a hex color."""
+    return f"\033[38;2;{int(color[1:3], 16)};{int(color[3:5], 16)};{int(color[5:7], 16)}m".encode()
+
+
+class TeeReader:
+    """Binary reader that copies everything read through it into `copy`.
+
+    read() returns whatever is buffered instead of waiting for a full
+    chunk, so MessagePack records decode as soon as they arrive.
+    """
+
+    def __init__(self, stream, copy=None):
+        self.stream = stream
+        self.copy = copy
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read1(size)
+        if self.copy is not None:
+            self.copy.write(data)
+        return data
+
+    def readline(self) -> bytes:
+        data = self.stream.readline()
+        if self.copy is not None:
+            self.copy.write(data)
+        return data
+
+
+def read_records(stream):
+    """Iterate the decoded records of a WIRE_FORMAT stream."""
+    if WIRE_FORMAT == "msgpack":
+        return msgpack.Unpacker(stream, raw=False, unicode_errors="replace", read_size=PIPE_BUFSIZE)
+    return map(loads, iter(stream.readline, b''))
+
+
+def colorhymn_version(colorhymn_dir: Path) -> str:
+    """Version stamp for cached output and the colorize server.
+
+    The mix.exs version plus the newest source mtime in whole seconds,
+    matching the stamp `mix colorize --serve` computes for itself.
+    """
+    match = re.search(r'version: "([^"]+)"', (colorhymn_dir / "mix.exs").read_text())
+    newest = max(int(p.stat().st_mtime) for p in (colorhymn_dir / "lib").rglob("*.ex"))
+    return f"{match.group(1) if match else 'dev'}-{newest}"
+
+
+def cache_path_for(file_path: str, colorhymn_dir: Path, suffix: str = WIRE_FORMAT) -> Path:
+    """Cache file for the current contents of file_path."""
+    file_path = os.path.abspath(file_path)
+    st = os.stat(file_path)
+    key = hashlib.blake2b(
+        f"{file_path}\0{st.st_mtime_ns}\0{st.st_size}\0{colorhymn_version(colorhymn_dir)}".encode(),
+        digest_size=16
+    ).hexdigest()
+    return CACHE_DIR / f"{key}.{suffix}"
+
+
+def open_cache_temp():
+    """Temp file in CACHE_DIR for an entry being written; None if unwritable.
+
+    Entries are renamed into place only once complete, so a failed or
+    abandoned run never leaves a truncated cache entry.
+    """
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".tmp", delete=False)
+    except OSError:
+        return None
+
+
+def store_cache(temp_path: str, cache_path: Path) -> None:
+    """Move a complete entry into place, then prune the cache to its limits."""
+    os.replace(temp_path, cache_path)
+
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, entry.path))
+
+    # Newest first: keep entries while they fit, drop the rest
+    entries.sort(reverse=True)
+    cutoff = time.time() - CACHE_MAX_AGE
+    total = 0
+    for mtime, size, path in entries:
+        total += size
+        if total > CACHE_MAX_BYTES or mtime < cutoff:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def touch_cache(cache_path: Path) -> None:
+    """Mark an entry as used so pruning keeps it."""
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+
+
 def colorize_file(file_path: str) -> dict:
-    """Call Colorhymn and get JSON output."""
+    """Call Colorhymn and stream its output records.
+
+    Returns a dict with the parsed "metadata", the "colors" table of hex
+    colors, and a "lines" generator that yields each line as soon as
+    Colorhymn writes it, as a dict of parallel token value ("v") and
+    color index ("c") lists. Output is cached on disk and replayed without
+    running mix while the file and Colorhymn are unchanged. Set
+    COLORHYMN_NO_CACHE to bypass the cache.
+    """
     colorhymn_dir = Path(__file__).parent.parent
+    # mix runs from colorhymn_dir, and the cache key must name the same file
+    file_path = os.path.abspath(file_path)
+
+    if os.environ.get("COLORHYMN_NO_CACHE"):
+        return run_colorize(file_path, colorhymn_dir)
+
+    cache_path = cache_path_for(file_path, colorhymn_dir)
+    try:
+        cached = open(cache_path, "rb", buffering=PIPE_BUFSIZE)
+    except FileNotFoundError:
+        return run_colorize(file_path, colorhymn_dir, cache_path)
+    touch_cache(cache_path)
+
+    records = read_records(cached)
+    header = next(records)
+
+    def lines():
+        with cached:
+            yield from records
+
+    return {"metadata": header["metadata"], "colors": header["colors"], "lines": lines()}
+
 
-    result = subprocess.run(
-        ["mix", "colorize", file_path],
-        capture_output=True,
-        text=True,
+def request_server(file_path: str, version: str):
+    """Ask the colorize server for file_path, positioned after the marker.
+
+    None if no server is listening, or it is stale or otherwise cannot
+    answer; mix colorize then reports any error itself.
+    """
+    if SOCKET_PATH is None:
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # A wedged server must not hang the viewer: past the deadline, run mix
+    sock.settimeout(COLORIZE_TIMEOUT)
+    stream = None
+    try:
+        sock.connect(str(SOCKET_PATH))
+        sock.sendall(f"{version} {WIRE_FORMAT} {file_path}\n".encode())
+        # The file object keeps the connection open after the socket is closed
+        stream = sock.makefile("rb", buffering=PIPE_BUFSIZE)
+        reply = stream.readline()
+        if reply != MARKERS[WIRE_FORMAT]:
+            stream.close()
+            return None
+        # Once records flow the reader sets the pace
+        sock.settimeout(None)
+    except OSError:
+        if stream is not None:
+            stream.close()
+        return None
+    finally:
+        sock.close()
+    return stream
+
+
+def start_server(colorhymn_dir: Path) -> None:
+    """Spawn a detached colorize server for later calls to use."""
+    if SOCKET_PATH is None:
+        return
+    subprocess.Popen(
+        ["mix", "colorize", "--serve", str(SOCKET_PATH)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
         cwd=str(colorhymn_dir),
-        timeout=30
+        start_new_session=True
     )
 
-    # Find JSON in output (skip compile warnings)
-    json_start = result.stdout.find('{')
-    if json_start == -1:
-        raise ValueError(f"No JSON output: {result.stderr}")
 
-    return json.loads(result.stdout[json_start:])
+def run_colorize(file_path: str, colorhymn_dir: Path, cache_path: Path = None) -> dict:
+    """Stream colorize output, saving it to cache_path once complete.
+
+    Uses the colorize server when one is listening and current. Otherwise
+    starts one for next time and runs mix colorize directly.
+    """
+    proc = None
+    stream = request_server(file_path, colorhymn_version(colorhymn_dir))
+    if stream is None:
+        start_server(colorhymn_dir)
+        format_args = ["--msgpack"] if WIRE_FORMAT == "msgpack" else []
+        # stderr goes to a file, not a pipe: compile warnings can exceed the
+        # pipe buffer and would block mix while we wait on stdout
+        stderr = tempfile.TemporaryFile()
+        proc = subprocess.Popen(
+            ["mix", "colorize", *format_args, file_path],
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            cwd=str(colorhymn_dir),
+            bufsize=PIPE_BUFSIZE
+        )
+        stream = proc.stdout
+
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            proc.kill()
+
+        deadline = threading.Timer(COLORIZE_TIMEOUT, kill)
+        deadline.start()
+
+    def mix_error() -> str:
+        """Why mix failed, once it has exited."""
+        proc.wait()
+        if timed_out.is_set():
+            return "Colorhymn timed out"
+        with stderr:
+            stderr.seek(0)
+            return stderr.read().decode(errors="replace")
 
+    # Skip compile output up to the marker; the header record follows it
+    if proc is not None:
+        try:
+            for line in iter(stream.readline, b''):
+                if line == MARKERS[WIRE_FORMAT]:
+                    break
+            else:
+                stream.close()
+                raise ValueError(f"No JSON output: {mix_error()}")
+        finally:
+            # The deadline covers startup; once records flow the reader sets the pace
+            deadline.cancel()
 
-def render_rich(data: dict, console: Console) -> None:
+    cache_file = open_cache_temp() if cache_path is not None else None
+
+    records = read_records(TeeReader(stream, cache_file))
+    header = next(records)
+    metadata = header["metadata"]
+
+    def lines():
+        count = 0
+        try:
+            for record in records:
+                yield record
+                count += 1
+        finally:
+            stream.close()
+            returncode = proc.wait() if proc is not None else 0
+            if cache_file is not None:
+                cache_file.close()
+                if returncode == 0 and count == metadata["line_count"]:
+                    store_cache(cache_file.name, cache_path)
+                else:
+                    os.unlink(cache_file.name)
+        if returncode != 0:
+            raise ValueError(mix_error())
+        if proc is not None:
+            stderr.close()
+        if count != metadata["line_count"]:
+            raise ValueError("Colorhymn output ended early")
+
+    return {"metadata": metadata, "colors": header["colors"], "lines": lines()}
+
+
+def build_text(prefix: str, values: list, indices: list, styles: list) -> "Text":
+    """Build a line's Text in one shot: a dim prefix, then the tokens.
+
+    Joins the plain text once and creates the span list from running
+    offsets, instead of going through Text.append for every token. Control
+    codes are stripped per token first, as Text would strip them from the
+    joined text and shift every later span.
+    """
+    values = [strip_control_codes(value) for value in values]
+    ends = list(accumulate(map(len, values), initial=len(prefix)))
+    spans = [Span(0, ends[0], "dim"), *map(Span, ends, ends[1:], map(styles.__getitem__, indices))]
+    return Text(prefix + "".join(values), spans=spans)
+
+
+def render_rich(data: dict, console: "Console") -> None:
     """Render with Rich."""
     meta = data["metadata"]
 
@@ -66,29 +385,86 @@ def render_rich(data: dict, console: Console) -> None:
     console.print()
 
     # Lines
-    for i, line_tokens in enumerate(data["lines"], 1):
-        text = Text()
-        text.append(f"{i:5d} ", style="dim")
+    styles = [Style.parse(color) for color in data["colors"]]
+    for i, line in enumerate(data["lines"], 1):
+        console.print(build_text(f"{i:5d} ", line["v"], line["c"], styles))
 
-        for token in line_tokens:
-            _, value, color = token
-            text.append(value, style=color)
 
-        console.print(text)
+def render_ansi(data: dict, cache_path: Path = None) -> None:
+    """Render with raw ANSI (fallback), saving the output to cache_path."""
+    meta = data["metadata"]
+    out = sys.stdout.buffer
+    sys.stdout.flush()
+    cache_file = open_cache_temp() if cache_path is not None else None
 
+    # Output accumulates in one bytearray and goes out in 64 KiB writes,
+    # so piping into less costs one syscall per chunk rather than per line
+    buf = bytearray(f"━━━ {meta['filename']} │ {meta['line_count']} lines │ temp: {meta['temperature']} │ mood: {meta['mood']} ━━━\n\n".encode())
 
-def render_ansi(data: dict) -> None:
-    """Render with raw ANSI (fallback)."""
-    meta = data["metadata"]
-    print(f"━━━ {meta['filename']} │ {meta['line_count']} lines │ temp: {meta['temperature']} │ mood: {meta['mood']} ━━━\n")
+    try:
+        sgr = [sgr_prefix(color) for color in data["colors"]]
+        for i, line in enumerate(data["lines"], 1):
+            buf += b"\033[2m%5d\033[0m " % i
+            for value, index in zip(line["v"], line["c"]):
+                buf += sgr[index]
+                buf += value.encode()
+                buf += SGR_RESET
+            buf += b"\n"
+
+            if len(buf) >= OUTPUT_BUFSIZE:
+                out.write(buf)
+                if cache_file is not None:
+                    cache_file.write(buf)
+                buf.clear()
+
+        out.write(buf)
+        out.flush()
+        if cache_file is not None:
+            cache_file.write(buf)
+            cache_file.close()
+            store_cache(cache_file.name, cache_path)
+            cache_file = None
+    finally:
+        if cache_file is not None:
+            cache_file.close()
+            os.unlink(cache_file.name)
 
-    for i, line_tokens in enumerate(data["lines"], 1):
-        parts = [f"\033[2m{i:5d}\033[0m "]
-        for token in line_tokens:
-            _, value, color = token
-            # Convert hex to simple ANSI (approximate)
-            parts.append(f"\033[38;2;{int(color[1:3], 16)};{int(color[3:5], 16)};{int(color[5:7], 16)}m{value}\033[0m")
-        print("".join(parts))
+
+def send_cached(cache_path: Path) -> bool:
+    """Copy a cached rendering to stdout; False if there is none.
+
+    Pipes and files get it through os.sendfile, so the kernel moves the
+    bytes without a pass through Python. Other outputs, and those sendfile
+    refuses (such as files opened with O_APPEND), are copied.
+    """
+    try:
+        cached = open(cache_path, "rb")
+    except FileNotFoundError:
+        return False
+    touch_cache(cache_path)
+
+    with cached:
+        sys.stdout.flush()
+        out_fd = sys.stdout.fileno()
+        mode = os.fstat(out_fd).st_mode
+        if stat.S_ISFIFO(mode) or stat.S_ISREG(mode):
+            offset = 0
+            size = os.fstat(cached.fileno()).st_size
+            try:
+                while offset < size:
+                    sent = os.sendfile(out_fd, cached.fileno(), offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return True
+            except OSError:
+                # Only a refusal before any bytes went out can be retried
+                if offset:
+                    raise
+
+        shutil.copyfileobj(cached, sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    return True
 
 
 def main():
@@ -100,13 +476,18 @@ def main():
     file_path = sys.argv[1]
 
     try:
-        data = colorize_file(file_path)
-
         if RICH_AVAILABLE:
+            data = colorize_file(file_path)
             console = Console(force_terminal=True)
             render_rich(data, console)
+        elif os.environ.get("COLORHYMN_NO_CACHE"):
+            render_ansi(colorize_file(file_path))
         else:
-            render_ansi(data)
+            # Without Rich, unchanged files replay their last rendering
+            # without decoding; Rich output is always rendered afresh
+            ansi_path = cache_path_for(file_path, Path(__file__).parent.parent, "ansi")
+            if not send_cached(ansi_path):
+                render_ansi(colorize_file(file_path), ansi_path)
 
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
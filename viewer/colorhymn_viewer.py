@@ -4,48 +4,30 @@ Colorhymn Viewer - Textual TUI for colorized log viewing.
 Optimized for: copy/paste, high density, small text.
 """
 
-import json
-import subprocess
 import sys
+from collections import OrderedDict
 from pathlib import Path
 
+from textual import work
 from textual.app import App, ComposeResult
 from textual.widgets import Static, Header, Footer, Input
-from textual.containers import ScrollableContainer, Vertical
+from textual.containers import Vertical
 from textual.binding import Binding
+from textual.geometry import Size
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+from rich.cells import cell_len
+from rich.segment import Segment
+from rich.style import Style
 from rich.text import Text
 
+from colorhymn_rich import build_text, colorize_file
 
-class LogLine(Static):
-    """A single log line with selectable, colorized text."""
+LINE_NUMBER_STYLE = Style(dim=True)
 
-    DEFAULT_CSS = """
-    LogLine {
-        height: auto;
-        width: 100%;
-        padding: 0;
-        margin: 0;
-    }
-    """
 
-    def __init__(self, tokens: list, line_num: int):
-        self.tokens = tokens
-        self.line_num = line_num
-        super().__init__()
-
-    def compose(self) -> ComposeResult:
-        text = Text()
-        for token in self.tokens:
-            token_type, value, color = token
-            text.append(value, style=color)
-
-        # Add line number prefix
-        prefix = Text(f"{self.line_num:5d} ", style="dim")
-        yield Static(prefix + text, markup=False)
-
-
-class LogViewer(ScrollableContainer):
-    """Scrollable container for log lines."""
+class LogViewer(ScrollView):
+    """Scrollable log view that only renders the rows in the viewport."""
 
     DEFAULT_CSS = """
     LogViewer {
@@ -55,6 +37,64 @@ class LogViewer(ScrollableContainer):
     }
     """
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lines = []
+        self.max_width = 0
+        # Rendered rows by line index, most recently used last
+        self._row_cache = OrderedDict()
+        self._styles = []
+
+    def set_colors(self, colors: list) -> None:
+        """Parse the color table that line records index into."""
+        self._styles = [Style.parse(color) for color in colors]
+
+    def append_lines(self, lines: list) -> None:
+        """Add token lines to the model and grow the virtual size."""
+        for number, line in enumerate(lines, len(self.lines) + 1):
+            # Same prefix as the rendered row, so tab stops line up too
+            plain = f"{number:5d} " + "".join(line["v"])
+            self.max_width = max(self.max_width, cell_len(plain.expandtabs()))
+        self.lines.extend(lines)
+        self.virtual_size = Size(self.max_width, len(self.lines))
+
+    def render_line(self, y: int) -> Strip:
+        """Build the strip for one visible row on demand."""
+        scroll_x, scroll_y = self.scroll_offset
+        index = scroll_y + y
+        width = self.size.width
+
+        if index >= len(self.lines):
+            return Strip.blank(width, self.rich_style)
+
+        if not self.lines[index]["v"]:
+            # Blank rows are only a line number: skip Text and the row cache
+            prefix = f"{index + 1:5d} "
+            strip = Strip([Segment(prefix, LINE_NUMBER_STYLE)], cell_len(prefix))
+            return strip.crop_extend(scroll_x, scroll_x + width, self.rich_style)
+
+        strip = self._row_cache.get(index)
+        if strip is None:
+            strip = self._render_row(index)
+            self._row_cache[index] = strip
+            if len(self._row_cache) > max(4 * self.size.height, 64):
+                self._row_cache.popitem(last=False)
+        else:
+            self._row_cache.move_to_end(index)
+
+        return strip.crop_extend(scroll_x, scroll_x + width, self.rich_style)
+
+    def _render_row(self, index: int) -> Strip:
+        """Render a full, uncropped row for the cache."""
+        line = self.lines[index]
+        text = build_text(f"{index + 1:5d} ", line["v"], line["c"], self._styles)
+        text.expand_tabs()
+
+        return Strip(text.render(self.app.console), text.cell_len)
+
+    def on_resize(self) -> None:
+        self._row_cache.clear()
+
 
 class ColorhymnApp(App):
     """Main Colorhymn TUI application."""
@@ -119,46 +159,28 @@ class ColorhymnApp(App):
     def on_mount(self) -> None:
         self.load_file()
 
+    @work(thread=True, exclusive=True)
     def load_file(self) -> None:
-        """Load and colorize file via Colorhymn."""
+        """Load and colorize file via Colorhymn, rendering lines as they stream in."""
         try:
-            # Call mix colorize
-            result = subprocess.run(
-                ["mix", "colorize", self.file_path],
-                capture_output=True,
-                text=True,
-                cwd=str(Path(__file__).parent.parent),
-                timeout=30
-            )
-
-            if result.returncode != 0:
-                self.notify(f"Error: {result.stderr}", severity="error")
-                return
-
-            # Parse JSON (skip any compile warnings)
-            json_start = result.stdout.find('{')
-            if json_start == -1:
-                self.notify("No JSON output from colorhymn", severity="error")
-                return
-
-            self.data = json.loads(result.stdout[json_start:])
-            self.render_log()
-
-        except subprocess.TimeoutExpired:
-            self.notify("Colorhymn timed out", severity="error")
-        except json.JSONDecodeError as e:
-            self.notify(f"JSON parse error: {e}", severity="error")
-        except Exception as e:
-            self.notify(f"Error: {e}", severity="error")
+            self.data = colorize_file(self.file_path)
+            self.call_from_thread(self.render_info, self.data["metadata"])
+            self.call_from_thread(self.set_colors, self.data["colors"])
+
+            batch = []
+            for line in self.data["lines"]:
+                batch.append(line)
+                if len(batch) >= 256:
+                    self.call_from_thread(self.render_log, batch)
+                    batch = []
+            if batch:
+                self.call_from_thread(self.render_log, batch)
 
-    def render_log(self) -> None:
-        """Render colorized log lines."""
-        if not self.data:
-            return
-
-        meta = self.data["metadata"]
+        except Exception as e:
+            self.call_from_thread(self.notify, f"Error: {e}", severity="error")
 
-        # Update info bar
+    def render_info(self, meta: dict) -> None:
+        """Render the file summary into the info bar."""
         info_bar = self.query_one("#info-bar", Static)
         info_text = Text()
         info_text.append(f" {meta['filename']} ", style="bold")
@@ -184,20 +206,14 @@ class ColorhymnApp(App):
 
         info_bar.update(info_text)
 
-        # Render lines
-        container = self.query_one("#log-container", LogViewer)
+    def set_colors(self, colors: list) -> None:
+        """Hand the color table for the records that follow to the log view."""
+        self.query_one("#log-container", LogViewer).set_colors(colors)
 
-        for i, line_tokens in enumerate(self.data["lines"], 1):
-            if line_tokens:  # Skip empty token lists
-                text = Text()
-                text.append(f"{i:5d} ", style="dim")
-                for token in line_tokens:
-                    token_type, value, color = token
-                    text.append(value, style=color)
-                container.mount(Static(text, markup=False))
-            else:
-                # Empty line
-                container.mount(Static(Text(f"{i:5d} ", style="dim"), markup=False))
+    def render_log(self, lines: list) -> None:
+        """Append a batch of colorized log lines."""
+        container = self.query_one("#log-container", LogViewer)
+        container.append_lines(lines)
 
     def action_scroll_top(self) -> None:
         container = self.query_one("#log-container")